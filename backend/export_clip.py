@@ -0,0 +1,50 @@
+"""
+Export the CLIP vision tower to ONNX and quantize it to INT8 for CPU inference.
+Requires `onnx` and `onnxruntime`. The classifier picks up clip_vision.int8.onnx
+automatically when running on CPU; label text embeddings are still computed once
+with PyTorch at startup.
+"""
+import os
+import torch
+from transformers import CLIPModel
+from onnxruntime.quantization import quantize_dynamic, QuantType
+
+from services.classifier import MODEL_NAME, ONNX_VISION_PATH
+
+FP32_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clip_vision.onnx")
+
+
+class VisionEncoder(torch.nn.Module):
+    """Wraps CLIPModel.get_image_features so it exports as a single graph."""
+
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+
+def export():
+    model = CLIPModel.from_pretrained(MODEL_NAME).eval()
+    dummy_pixels = torch.randn(1, 3, 224, 224)
+
+    print(f"Exporting vision encoder to {FP32_PATH}...")
+    torch.onnx.export(
+        VisionEncoder(model),
+        (dummy_pixels,),
+        FP32_PATH,
+        input_names=["pixel_values"],
+        output_names=["image_embeds"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+        opset_version=17,
+    )
+
+    print(f"Quantizing to INT8 at {ONNX_VISION_PATH}...")
+    quantize_dynamic(FP32_PATH, ONNX_VISION_PATH, weight_type=QuantType.QInt8)
+    os.remove(FP32_PATH)
+    print("Export complete.")
+
+
+if __name__ == "__main__":
+    export()
@@ -3,24 +3,44 @@ Smart Wardrobe — FastAPI Backend
 Main application with all REST API endpoints.
 """
 import os
-import json
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import orjson
 import uuid
 import shutil
+import aiofiles
 from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, Query, Body
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete
+from sqlalchemy.orm import Session, defer
 from dotenv import load_dotenv
 from pydantic import BaseModel
 
 from models.database import init_db, get_db, ClothingItem
 from models.user import User  # Import User to register with SQLAlchemy Base
-from services.classifier import classify_clothing, get_image_embedding
-from services.embeddings import get_embedding_index
+from services.batcher import get_clip_batcher
+from services.classifier import warmup as warmup_classifier
+from services.embeddings import get_embedding_index, embedding_to_bytes, embedding_from_bytes
 from services.recommender import get_outfit_recommendations
-from services.shopping import analyze_wardrobe_gaps
+from services.rag import retrieve_fashion_context
+from services.shopping import analyze_wardrobe_gaps, analyze_wardrobe_gaps_multi, ESSENTIAL_CATEGORIES
 from services.auth import verify_google_token, create_access_token, get_current_user, get_optional_user
 from services.search import search_images, download_image
+from services.response_cache import response_cache
+
+logger = logging.getLogger("smart_wardrobe")
+
+# Log records are queued and written by a background thread so handlers never block the event loop
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+logger.addHandler(QueueHandler(_log_queue))
+logger.setLevel(logging.INFO)
+logger.propagate = False
 
 # Load .env from project root
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -30,6 +50,7 @@ app = FastAPI(
     title="Smart Wardrobe API",
     description="Intelligent wardrobe assistant with AI-powered clothing classification and outfit recommendations",
     version="2.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # CORS — allow frontend
@@ -41,20 +62,71 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class SkipUploadsGZipMiddleware:
+    """GZip responses except under /uploads — images are already compressed, re-gzipping them only burns CPU."""
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not scope["path"].startswith("/uploads"):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+# Compress JSON responses (item lists compress well)
+app.add_middleware(SkipUploadsGZipMiddleware, minimum_size=1024)
+
 # Local image storage
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Embedding columns are only needed for similarity lookups, never in API responses
+SKIP_EMBEDDINGS = (defer(ClothingItem.embedding_json), defer(ClothingItem.embedding_bytes))
+
+class CachedStaticFiles(StaticFiles):
+    """Static files with long-lived cache headers — upload filenames are unique and never rewritten."""
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code == 200:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
 
 # Mount uploads directory for serving images
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app.mount("/uploads", CachedStaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 
 @app.on_event("startup")
 def startup():
+    _log_listener.start()
     init_db()
     print("✅ Database initialized")
     print(f"📁 Upload directory: {UPLOAD_DIR}")
 
+    # Load models and indexes up front instead of on the first request
+    if os.getenv("WARMUP", "1") == "1":
+        warmup_classifier()
+        get_embedding_index()
+        retrieve_fashion_context("casual outfit")
+        print("🔥 Models and indexes warmed up")
+
+
+@app.on_event("shutdown")
+def shutdown():
+    get_embedding_index().flush()
+    _log_listener.stop()
+
+
+def _remove_file(path: str):
+    """Delete a file if it exists."""
+    if os.path.exists(path):
+        os.remove(path)
+
 
 # ─── Auth Endpoints ─────────────────────────────────────────────────────────
 
@@ -97,12 +169,42 @@ def search_items(q: str = Query(..., min_length=2), user: User = Depends(get_cur
     images = search_images(q, max_results=20)
     return {"images": images}
 
+def _save_classified_item(db: Session, user_id: int, name: str | None, filename: str, classification: dict, embedding) -> dict:
+    """
+    Store a classified upload and add it to the FAISS index. Blocking (DB I/O and the
+    index lock), so async handlers run it in the threadpool.
+    """
+    item = ClothingItem(
+        name=name or f"{classification['color'].title()} {classification['category'].title()}",
+        category=classification["category"],
+        color=classification["color"],
+        pattern=classification["pattern"],
+        season=classification["season"],
+        fabric=classification["fabric"],
+        occasion_tags=orjson.dumps(classification["occasion_tags"]).decode(),
+        image_path=f"/uploads/{filename}",
+        embedding_bytes=embedding_to_bytes(embedding),
+        confidence=classification["confidence"],
+        user_id=user_id # Link to user
+    )
+
+    db.add(item)
+    db.flush()  # assigns item.id; snapshot before commit expires the instance
+    item_dict = item.to_dict()
+    db.commit()
+
+    # Add to FAISS
+    get_embedding_index().add_item(item_dict["id"], embedding, user_id=user_id)
+    response_cache.invalidate_user(user_id)
+    return item_dict
+
+
 class AddFromUrlRequest(BaseModel):
     image_url: str
     name: str = None
 
 @app.post("/api/items/from-url")
-def add_item_from_url(
+async def add_item_from_url(
     request: AddFromUrlRequest,
     user: User = Depends(get_current_user), 
     db: Session = Depends(get_db)
@@ -110,44 +212,24 @@ def add_item_from_url(
     """Download image from URL, classify, and add to wardrobe."""
     try:
         # Download image
-        filepath = download_image(request.image_url, UPLOAD_DIR)
+        filepath = await run_in_threadpool(download_image, request.image_url, UPLOAD_DIR)
         filename = os.path.basename(filepath)
 
-        # Classify
-        classification = classify_clothing(filepath)
-        embedding = get_image_embedding(filepath)
-
-        # Create Record
-        item = ClothingItem(
-            name=request.name or f"{classification['color'].title()} {classification['category'].title()}",
-            category=classification["category"],
-            color=classification["color"],
-            pattern=classification["pattern"],
-            season=classification["season"],
-            fabric=classification["fabric"],
-            occasion_tags=json.dumps(classification["occasion_tags"]),
-            image_path=f"/uploads/{filename}",
-            embedding_json=json.dumps(embedding),
-            confidence=classification["confidence"],
-            user_id=user.id # Link to user
-        )
-
-        db.add(item)
-        db.commit()
-        db.refresh(item)
+        # Classify and embed (batched with concurrent uploads)
+        classification, embedding = await get_clip_batcher().submit(filepath)
 
-        # Add to FAISS
-        idx = get_embedding_index()
-        idx.add_item(item.id, embedding, user_id=user.id)
+        # Create record and add to FAISS off the event loop (blocking DB I/O and index lock)
+        item_dict = await run_in_threadpool(
+            _save_classified_item, db, user.id, request.name, filename, classification, embedding
+        )
 
         return {
             "status": "success",
-            "item": item.to_dict(),
+            "item": item_dict,
             "classification": classification,
         }
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Add from URL failed")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -168,56 +250,45 @@ async def upload_item(
     filename = f"{uuid.uuid4().hex}{ext}"
     filepath = os.path.join(UPLOAD_DIR, filename)
 
-    contents = await image.read()
-    with open(filepath, "wb") as f:
-        f.write(contents)
+    # Stream the upload to disk in 1MB chunks instead of buffering it in memory
+    async with aiofiles.open(filepath, "wb") as f:
+        while chunk := await image.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
 
     try:
-        classification = classify_clothing(filepath)
-        embedding = get_image_embedding(filepath)
-
-        item = ClothingItem(
-            name=name or f"{classification['color'].title()} {classification['category'].title()}",
-            category=classification["category"],
-            color=classification["color"],
-            pattern=classification["pattern"],
-            season=classification["season"],
-            fabric=classification["fabric"],
-            occasion_tags=json.dumps(classification["occasion_tags"]),
-            image_path=f"/uploads/{filename}",
-            embedding_json=json.dumps(embedding),
-            confidence=classification["confidence"],
-            user_id=user.id # Link to user
-        )
+        classification, embedding = await get_clip_batcher().submit(filepath)
 
-        db.add(item)
-        db.commit()
-        db.refresh(item)
-
-        idx = get_embedding_index()
-        idx.add_item(item.id, embedding, user_id=user.id)
+        item_dict = await run_in_threadpool(
+            _save_classified_item, db, user.id, name, filename, classification, embedding
+        )
 
         return {
             "status": "success",
-            "item": item.to_dict(),
+            "item": item_dict,
             "classification": classification,
         }
 
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        logger.exception("Upload classification failed")
+        await run_in_threadpool(_remove_file, filepath)
         raise HTTPException(status_code=500, detail=f"Classification failed: {str(e)}")
 
 
 @app.get("/api/items")
 def list_items(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """List all wardrobe items for the current user."""
-    # Filter by user_id
-    items = db.query(ClothingItem).filter(ClothingItem.user_id == user.id).order_by(ClothingItem.created_at.desc()).all()
+    # Filter by user_id, fetching rows in batches rather than materializing them all at once
+    query = (
+        db.query(ClothingItem)
+        .options(*SKIP_EMBEDDINGS)
+        .filter(ClothingItem.user_id == user.id)
+        .order_by(ClothingItem.created_at.desc())
+        .execution_options(stream_results=True)
+        .yield_per(200)
+    )
+    items = [item.to_dict() for item in query]
     return {
-        "items": [item.to_dict() for item in items],
+        "items": items,
         "total": len(items),
     }
 
@@ -225,7 +296,7 @@ def list_items(user: User = Depends(get_current_user), db: Session = Depends(get
 @app.get("/api/items/{item_id}")
 def get_item(item_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get a single wardrobe item by ID (must belong to user)."""
-    item = db.query(ClothingItem).filter(ClothingItem.id == item_id, ClothingItem.user_id == user.id).first()
+    item = db.query(ClothingItem).options(*SKIP_EMBEDDINGS).filter(ClothingItem.id == item_id, ClothingItem.user_id == user.id).first()
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     return {"item": item.to_dict()}
@@ -234,20 +305,22 @@ def get_item(item_id: int, user: User = Depends(get_current_user), db: Session =
 @app.delete("/api/items/{item_id}")
 def delete_item(item_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Delete a wardrobe item."""
-    item = db.query(ClothingItem).filter(ClothingItem.id == item_id, ClothingItem.user_id == user.id).first()
+    owned = (ClothingItem.id == item_id, ClothingItem.user_id == user.id)
+    item = db.query(ClothingItem.image_path).filter(*owned).first()
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
 
     if item.image_path:
         full_path = os.path.join(os.path.dirname(__file__), item.image_path.lstrip("/"))
-        if os.path.exists(full_path):
-            os.remove(full_path)
+        _remove_file(full_path)
 
     idx = get_embedding_index()
     idx.remove_item(item_id)
 
-    db.delete(item)
+    # Bulk DELETE — no ORM instance to load or synchronize
+    db.execute(delete(ClothingItem).where(*owned).execution_options(synchronize_session=False))
     db.commit()
+    response_cache.invalidate_user(user.id)
 
     return {"status": "deleted", "id": item_id}
 
@@ -261,20 +334,28 @@ def find_similar(
 ):
     """Find items similar to a given item using FAISS embedding search."""
     item = db.query(ClothingItem).filter(ClothingItem.id == item_id, ClothingItem.user_id == user.id).first()
-    if not item or not item.embedding_json:
+    if not item or not item.embedding_bytes:
         raise HTTPException(status_code=404, detail="Item not found or has no embedding")
 
-    embedding = json.loads(item.embedding_json)
+    embedding = embedding_from_bytes(item.embedding_bytes)
     idx = get_embedding_index()
     # Pass user_id to filter results
     results = idx.search_similar(embedding, k=k, exclude_id=item_id, user_id=user.id)
 
+    # Single DB lookup for all hits, double-checking ownership; keep FAISS ranking order
+    ids = [sim_id for sim_id, _ in results]
+    rows = (
+        db.query(ClothingItem)
+        .options(*SKIP_EMBEDDINGS)
+        .filter(ClothingItem.id.in_(ids), ClothingItem.user_id == user.id)
+        .all()
+    )
+    rows_by_id = {row.id: row for row in rows}
+
     similar_items = []
     for sim_id, score in results:
-        # DB lookup to double check ownership and get details
-        sim_item = db.query(ClothingItem).filter(ClothingItem.id == sim_id).first() 
-        # Note: We don't strictly enforce user_id here if FAISS did its job, but good for safety
-        if sim_item and sim_item.user_id == user.id:
+        sim_item = rows_by_id.get(sim_id)
+        if sim_item:
             d = sim_item.to_dict()
             d["similarity_score"] = round(score, 3)
             similar_items.append(d)
@@ -294,8 +375,11 @@ def recommend_outfits(
     db: Session = Depends(get_db)  # Need DB to get items
 ):
     """Get AI-powered outfit recommendations."""
-    # We need to pass user to get_outfit_recommendations
-    # I need to update the service function to accept user_id or list of items
+    cache_key = (user.id, "recommendations", occasion, city, style, num_outfits)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     result = get_outfit_recommendations(
         occasion=occasion,
         city=city,
@@ -304,6 +388,7 @@ def recommend_outfits(
         user_id=user.id, # New parameter
         db=db # Pass DB session
     )
+    response_cache.set(cache_key, result)
     return result
 
 
@@ -316,14 +401,60 @@ def shopping_suggestions(
     db: Session = Depends(get_db)
 ):
     """Get shopping suggestions based on wardrobe gap analysis."""
+    cache_key = (user.id, "shopping", occasion)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     result = analyze_wardrobe_gaps(
         occasion_focus=occasion,
         user_id=user.id,
         db=db
     )
+    response_cache.set(cache_key, result)
     return result
 
 
+@app.get("/api/shopping/multi")
+def shopping_suggestions_multi(
+    occasion: list[str] = Query(..., description="Occasions to get suggestions for"),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get shopping suggestions for several occasions, generated together."""
+    # Each occasion costs its own Gemini call, so only accept the known focuses (which also bounds the list)
+    occasion = list(dict.fromkeys(occasion))
+    unknown = [focus for focus in occasion if focus not in ESSENTIAL_CATEGORIES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown occasion(s): {', '.join(unknown)}")
+
+    results = {}
+    missing = []
+    for focus in occasion:
+        cached = response_cache.get((user.id, "shopping", focus))
+        if cached is not None:
+            results[focus] = cached
+        else:
+            missing.append(focus)
+
+    if missing:
+        generated = analyze_wardrobe_gaps_multi(missing, user_id=user.id, db=db)
+        for focus, result in generated.items():
+            # Share entries with /api/shopping so single-occasion views hit the cache afterwards
+            response_cache.set((user.id, "shopping", focus), result)
+        results.update(generated)
+
+    return {focus: results[focus] for focus in occasion}
+
+
+# ─── Cache Stats ───────────────────────────────────────────────────────────
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    """Response cache hit/miss statistics."""
+    return response_cache.stats()
+
+
 # ─── Health Check ──────────────────────────────────────────────────────────
 
 @app.get("/api/health")
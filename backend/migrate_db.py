@@ -1,9 +1,12 @@
 import sqlite3
 import os
+import sys
+import json
+import numpy as np
 
 DB_PATH = "wardrobe.db"
 
-def migrate():
+def migrate(drop_json_embeddings: bool = False):
     if not os.path.exists(DB_PATH):
         print(f"Database {DB_PATH} not found. Nothing to migrate.")
         return
@@ -33,8 +36,55 @@ def migrate():
             # Optional: Assign existing items to a default user ID if needed?
             # For now, we'll leave them as NULL (if nullable) or 0. 
             # The model definition probably enforces a relationship.
+
+        # 2. Store embeddings as raw float32 bytes instead of JSON text
+        if "embedding_bytes" in columns:
+            print("Column 'embedding_bytes' already exists in 'clothing_items'.")
+        else:
+            print("Adding 'embedding_bytes' column to 'clothing_items'...")
+            cursor.execute("ALTER TABLE clothing_items ADD COLUMN embedding_bytes BLOB")
+            print("Column added.")
+
+        cursor.execute(
+            "SELECT id, embedding_json FROM clothing_items "
+            "WHERE embedding_json IS NOT NULL AND embedding_bytes IS NULL"
+        )
+        rows = cursor.fetchall()
+        updates = []
+        for item_id, embedding_json in rows:
+            # Same layout as services.embeddings.embedding_to_bytes: L2-normalized little-endian float32
+            vec = np.asarray(json.loads(embedding_json), dtype="<f4")
+            norm = np.linalg.norm(vec)
+            if norm > 0:
+                vec = vec / norm
+            updates.append((vec.astype("<f4").tobytes(), item_id))
+        cursor.executemany("UPDATE clothing_items SET embedding_bytes = ? WHERE id = ?", updates)
+        if rows:
+            print(f"Converted {len(rows)} JSON embeddings to float32 bytes.")
+
+        # Dropping the JSON copies (~4x the size of the bytes) is irreversible and breaks
+        # rolling back to code that reads embedding_json, so it only happens on request
+        reclaimed = 0
+        if drop_json_embeddings:
+            cursor.execute(
+                "UPDATE clothing_items SET embedding_json = NULL "
+                "WHERE embedding_json IS NOT NULL AND embedding_bytes IS NOT NULL"
+            )
+            reclaimed = cursor.rowcount
+            if reclaimed:
+                print(f"Cleared {reclaimed} legacy JSON embeddings.")
+
+        # 3. Compound indexes for per-user listing and id lookups
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_ci_user_created ON clothing_items(user_id, created_at DESC)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_ci_user_id ON clothing_items(user_id, id)")
+        print("Ensured indexes 'ix_ci_user_created' and 'ix_ci_user_id'.")
             
         conn.commit()
+
+        # VACUUM cannot run inside a transaction, so it goes after the commit
+        if reclaimed:
+            cursor.execute("VACUUM")
+            print("Database compacted.")
         print("Migration complete.")
         
     except Exception as e:
@@ -44,4 +94,5 @@ def migrate():
         conn.close()
 
 if __name__ == "__main__":
-    migrate()
+    # python migrate_db.py --drop-json-embeddings  (once the BLOB-reading code is deployed for good)
+    migrate(drop_json_embeddings="--drop-json-embeddings" in sys.argv)
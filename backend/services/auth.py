@@ -2,26 +2,42 @@
 Authentication service for Google Sign-In and JWT management.
 """
 import os
+import json
 import time
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from google.oauth2 import id_token
+import requests as http_requests
+from google.auth import jwt as google_jwt
 from google.auth.transport import requests
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 
 from models.database import get_db
 from models.user import User
+from services.response_cache import QueryCache
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "dev_secret_key_change_in_prod")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 30
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+GOOGLE_CERTS_TTL_SECONDS = 3600
+
+# Pooled HTTP session for Google cert fetches, plus a TTL cache of the certs themselves
+_google_request = requests.Request(session=http_requests.Session())
+_google_certs: dict | None = None
+_google_certs_fetched_at = 0.0
+
+# Recently authenticated users keyed by (user_id, token) — skips the DB lookup on every request
+USER_CACHE_TTL_SECONDS = 60
+_user_cache = QueryCache(ttl=USER_CACHE_TTL_SECONDS, max_entries=10_000)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -34,6 +50,23 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def _get_google_certs(force_refresh: bool = False) -> dict:
+    """Return Google's ID token signing certs, re-fetching at most once per TTL."""
+    global _google_certs, _google_certs_fetched_at
+    if force_refresh or _google_certs is None or time.time() - _google_certs_fetched_at > GOOGLE_CERTS_TTL_SECONDS:
+        response = _google_request(GOOGLE_CERTS_URL, method="GET")
+        if response.status != 200:
+            raise ValueError(f"Could not fetch Google certificates: HTTP {response.status}")
+        _google_certs = json.loads(response.data)
+        _google_certs_fetched_at = time.time()
+    return _google_certs
+
+def _decode_google_token(token: str, certs: dict) -> dict:
+    id_info = google_jwt.decode(token, certs=certs, audience=GOOGLE_CLIENT_ID, clock_skew_in_seconds=10)
+    if id_info.get("iss") not in GOOGLE_ISSUERS:
+        raise ValueError(f"Wrong issuer. 'iss' should be one of {GOOGLE_ISSUERS} but is {id_info.get('iss')}")
+    return id_info
+
 def verify_google_token(token: str):
     # DEVELOPMENT BYPASS
     # If no client ID is set, or if using a special test token, return mock data
@@ -47,13 +80,11 @@ def verify_google_token(token: str):
         }
 
     try:
-        id_info = id_token.verify_oauth2_token(
-            token, 
-            requests.Request(), 
-            GOOGLE_CLIENT_ID,
-            clock_skew_in_seconds=10
-        )
-        return id_info
+        certs = _get_google_certs()
+        # Google rotates its signing keys; refetch when the token is signed by a key we haven't seen
+        if google_jwt.decode_header(token).get("kid") not in certs:
+            certs = _get_google_certs(force_refresh=True)
+        return _decode_google_token(token, certs)
     except ValueError as e:
         raise HTTPException(status_code=401, detail=f"Invalid Google token: {str(e)}")
 
@@ -71,19 +102,33 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
         
+    cache_key = (user_id, token)
+    user = _user_cache.get(cache_key)
+    if user is not None:
+        return user
+
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
         raise credentials_exception
+    # Detach so the cached instance outlives this request's session without being expired
+    db.expunge(user)
+    _user_cache.set(cache_key, user)
     return user
 
-def get_optional_user(token: Optional[str] = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_optional_user(token: Optional[str] = Depends(oauth2_scheme_optional), db: Session = Depends(get_db)):
     """
     Returns user if token is valid, else None. 
     Used for migration/hybrid states or public endpoints.
     """
     if not token:
         return None
+    # Skip the signature check and DB lookup for tokens that are obviously malformed
+    try:
+        if not jwt.get_unverified_claims(token).get("sub"):
+            return None
+    except JWTError:
+        return None
     try:
-        return get_current_user(token, db)
-    except:
+        return await get_current_user(token, db)
+    except HTTPException:
         return None
@@ -0,0 +1,78 @@
+"""
+Request-level micro-batching for CLIP inference.
+Coalesces images from concurrent uploads that arrive within a short window
+into a single batched forward pass, then scatters results back to each request.
+"""
+import asyncio
+import numpy as np
+from services.classifier import classify_and_embed_batch
+
+MAX_BATCH_SIZE = 8
+MAX_WAIT_MS = 20
+
+
+class ClipBatcher:
+    """Queues image paths and classifies them in batches on a background task."""
+
+    def __init__(self, max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: int = MAX_WAIT_MS):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def submit(self, image_path: str) -> tuple[dict, np.ndarray]:
+        """Classify and embed an image, batched with any concurrent submissions."""
+        loop = asyncio.get_running_loop()
+        # A worker bound to a closed loop (e.g. a previous TestClient) never finishes; replace it too
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        await self._queue.put((image_path, future))
+        return await future
+
+    async def _run(self):
+        """Collect up to max_batch_size requests (or wait max_wait) and run one forward pass."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            paths = [path for path, _ in batch]
+            try:
+                # CLIP is CPU/GPU-bound — keep it off the event loop
+                results = await loop.run_in_executor(None, classify_and_embed_batch, paths)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # Failures are per image, so one bad upload doesn't fail the rest of its batch
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+# Singleton instance
+_batcher = None
+
+
+def get_clip_batcher() -> ClipBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = ClipBatcher()
+    return _batcher
@@ -3,11 +3,20 @@ CLIP-based clothing classifier using zero-shot classification.
 Classifies uploaded clothing images across multiple dimensions:
 category, color, pattern, season, and fabric.
 """
+import os
+import threading
+import numpy as np
 import torch
+import torch.nn.functional as F
 from PIL import Image
 from transformers import CLIPProcessor, CLIPModel
 from functools import lru_cache
 
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
 # Classification labels for each dimension
 CATEGORIES = [
     "t-shirt", "shirt", "blouse", "sweater", "hoodie",
@@ -49,63 +58,142 @@ OCCASIONS = [
     "outdoor/adventure",
 ]
 
+# (dimension, labels, prompt prefix) — all prompts are scored in one CLIP pass
+DIMENSIONS = [
+    ("category", CATEGORIES, "a "),
+    ("color", COLORS, ""),
+    ("pattern", PATTERNS, "a clothing item with "),
+    ("season", SEASONS, ""),
+    ("fabric", FABRICS, "a clothing item made of "),
+    ("occasion", OCCASIONS, ""),
+]
+
+# Flat prompt list plus (start, end) offsets of each dimension within it
+ALL_PROMPTS: list[str] = []
+SLICES: dict[str, tuple[int, int]] = {}
+for _name, _labels, _prefix in DIMENSIONS:
+    SLICES[_name] = (len(ALL_PROMPTS), len(ALL_PROMPTS) + len(_labels))
+    ALL_PROMPTS.extend(f"a photo of {_prefix}{label}" for label in _labels)
+
 MODEL_NAME = "openai/clip-vit-base-patch32"
+# INT8-quantized vision tower produced by export_clip.py (used on CPU when present)
+ONNX_VISION_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "clip_vision.int8.onnx")
 
 _model = None
 _processor = None
+_text_features = None
+_vision_session = None
+_model_lock = threading.Lock()
 
 
-def _get_model():
-    """Lazy-load the CLIP model and processor."""
-    global _model, _processor
-    if _model is None:
-        print("Loading CLIP model... (this may take a moment on first run)")
-        _model = CLIPModel.from_pretrained(MODEL_NAME)
-        _processor = CLIPProcessor.from_pretrained(MODEL_NAME)
-        _model.eval()
-        print("CLIP model loaded successfully.")
-    return _model, _processor
+def _inference_device() -> str:
+    """Pick the fastest available accelerator for CLIP inference."""
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+_DEVICE = _inference_device()
 
 
-def _classify_dimension(image: Image.Image, labels: list[str], prefix: str = "") -> tuple[str, float]:
+def _inference_dtype() -> torch.dtype:
     """
-    Run zero-shot classification for a single dimension.
-    Returns (best_label, confidence_score).
+    Use float16 on CUDA tensor cores, bfloat16 where the CPU has native support
+    for it, otherwise stay in float32.
     """
+    if _DEVICE == "cuda":
+        return torch.float16
+    if _DEVICE == "mps":
+        return torch.float32
+    try:
+        if torch.ops.mkldnn._is_mkldnn_bf16_supported():
+            return torch.bfloat16
+    except (AttributeError, RuntimeError):
+        pass
+    return torch.float32
+
+
+_DTYPE = _inference_dtype()
+
+
+def _prepare_inputs(inputs) -> dict:
+    """Move model inputs to the inference device, casting pixel values to the inference dtype."""
+    return {
+        k: v.to(_DEVICE, dtype=_DTYPE) if v.is_floating_point() else v.to(_DEVICE)
+        for k, v in inputs.items()
+    }
+
+
+def _get_model():
+    """Lazy-load the CLIP model and processor, and embed the label prompts once."""
+    global _model, _processor, _text_features, _vision_session
+    with _model_lock:
+        if _model is None:
+            print("Loading CLIP model... (this may take a moment on first run)")
+            _model = CLIPModel.from_pretrained(MODEL_NAME).to(_DEVICE, dtype=_DTYPE)
+            _processor = CLIPProcessor.from_pretrained(MODEL_NAME)
+            _model.eval()
+
+            # Label prompts are static, so their normalized text embeddings are computed once
+            text_inputs = _processor(text=ALL_PROMPTS, return_tensors="pt", padding=True)
+            with torch.inference_mode():
+                _text_features = F.normalize(_model.get_text_features(**_prepare_inputs(text_inputs)), dim=-1)
+
+            if _DEVICE == "cpu" and ort is not None and os.path.exists(ONNX_VISION_PATH):
+                _vision_session = ort.InferenceSession(ONNX_VISION_PATH, providers=["CPUExecutionProvider"])
+                print(f"Using INT8 ONNX vision encoder: {ONNX_VISION_PATH}")
+            print(f"CLIP model loaded successfully on {_DEVICE} ({_DTYPE}).")
+    return _model, _processor
+
+
+def _encode_image(image: Image.Image | list[Image.Image]) -> torch.Tensor:
+    """Run the CLIP vision tower once and return the raw image features ([N, 512])."""
     model, processor = _get_model()
 
-    # Add descriptive prefix to labels for better CLIP accuracy
-    text_labels = [f"a photo of {prefix}{label}" for label in labels]
+    if _vision_session is not None:
+        pixel_values = processor(images=image, return_tensors="np")["pixel_values"]
+        (features,) = _vision_session.run(None, {"pixel_values": pixel_values.astype("float32")})
+        return torch.from_numpy(features).to(_DEVICE, dtype=_DTYPE)
 
-    inputs = processor(
-        text=text_labels,
-        images=image,
-        return_tensors="pt",
-        padding=True,
-    )
+    inputs = _prepare_inputs(processor(images=image, return_tensors="pt"))
+    with torch.inference_mode():
+        return model.get_image_features(**inputs)
 
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits_per_image[0]
-        probs = logits.softmax(dim=0)
 
-    best_idx = probs.argmax().item()
-    return labels[best_idx], probs[best_idx].item()
+def _to_embeddings(image_features: torch.Tensor) -> np.ndarray:
+    """Convert raw image features to L2-normalized float32 embeddings ([N, 512]) for storage and search."""
+    with torch.inference_mode():
+        return F.normalize(image_features.float(), dim=-1).cpu().numpy()
 
 
-def classify_clothing(image_path: str) -> dict:
+def _classify_features(image_features: torch.Tensor) -> dict:
     """
-    Classify a clothing image across all dimensions.
+    Run zero-shot classification for every dimension by scoring the image features
+    against the cached label embeddings.
     Returns a dict with category, color, pattern, season, fabric, occasion, and confidence.
     """
-    image = Image.open(image_path).convert("RGB")
+    model, _ = _get_model()
+
+    with torch.inference_mode():
+        # Score in float32: bf16 would round logits (~30) to 0.125-0.25 steps and flip close labels
+        image_features = F.normalize(image_features.float(), dim=-1)
+        logits = (image_features @ _text_features.float().T)[0] * model.logit_scale.float().exp()
 
-    category, cat_conf = _classify_dimension(image, CATEGORIES, prefix="a ")
-    color, _ = _classify_dimension(image, COLORS, prefix="")
-    pattern, _ = _classify_dimension(image, PATTERNS, prefix="a clothing item with ")
-    season, _ = _classify_dimension(image, SEASONS, prefix="")
-    fabric, _ = _classify_dimension(image, FABRICS, prefix="a clothing item made of ")
-    occasion, _ = _classify_dimension(image, OCCASIONS, prefix="")
+    results = {}
+    for name, labels, _ in DIMENSIONS:
+        start, end = SLICES[name]
+        probs = logits[start:end].softmax(dim=0)
+        best_idx = probs.argmax().item()
+        results[name] = (labels[best_idx], probs[best_idx].item())
+
+    category, cat_conf = results["category"]
+    color, _ = results["color"]
+    pattern, _ = results["pattern"]
+    season, _ = results["season"]
+    fabric, _ = results["fabric"]
+    occasion, _ = results["occasion"]
 
     # Clean up season label
     season_clean = season.replace(" lightweight clothing", "").replace(" warm clothing", "").replace(" versatile clothing", "")
@@ -123,17 +211,50 @@ def classify_clothing(image_path: str) -> dict:
     }
 
 
-def get_image_embedding(image_path: str) -> list[float]:
+def classify_and_embed_batch(image_paths: list[str]) -> list[tuple[dict, np.ndarray] | Exception]:
+    """
+    Classify and embed several clothing images with one batched vision forward pass.
+    Returns a (classification, embedding) tuple per image, in input order. An image that
+    fails to decode or classify gets its exception instead, without affecting the others.
+    """
+    results: list[tuple[dict, np.ndarray] | Exception] = [None] * len(image_paths)
+    images, positions = [], []
+    for i, path in enumerate(image_paths):
+        try:
+            images.append(Image.open(path).convert("RGB"))
+            positions.append(i)
+        except Exception as e:
+            results[i] = e
+
+    if images:
+        try:
+            image_features = _encode_image(images)
+            embeddings = _to_embeddings(image_features)
+        except Exception as e:
+            for i in positions:
+                results[i] = e
+            return results
+
+        for row, i in enumerate(positions):
+            try:
+                results[i] = (_classify_features(image_features[row:row + 1]), embeddings[row])
+            except Exception as e:
+                results[i] = e
+    return results
+
+
+def get_text_embeddings(texts: list[str]) -> np.ndarray:
     """
-    Generate a CLIP image embedding for a clothing item.
-    Returns a list of floats (512-d vector).
+    Embed text with the shared CLIP text tower.
+    Returns L2-normalized float32 embeddings ([N, 512]).
     """
     model, processor = _get_model()
-    image = Image.open(image_path).convert("RGB")
+    inputs = processor(text=texts, return_tensors="pt", padding=True, truncation=True, max_length=77)
+    with torch.inference_mode():
+        text_features = F.normalize(model.get_text_features(**_prepare_inputs(inputs)), dim=-1)
+    return text_features.float().cpu().numpy()
 
-    inputs = processor(images=image, return_tensors="pt")
-    with torch.no_grad():
-        outputs = model.get_image_features(**inputs)
-        embedding = outputs[0].cpu().numpy().tolist()
 
-    return embedding
+def warmup():
+    """Load CLIP and run one forward pass on a blank image so the first upload doesn't pay for it."""
+    _classify_features(_encode_image(Image.new("RGB", (32, 32))))
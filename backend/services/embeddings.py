@@ -2,153 +2,456 @@
 CLIP embedding management and FAISS vector index for wardrobe similarity search.
 """
 import os
-import json
+import threading
+import time
 import numpy as np
 import faiss
+from sqlalchemy import func
 from models.database import SessionLocal, ClothingItem
 
 EMBEDDING_DIM = 512
 INDEX_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "faiss_index.bin")
+# Sidecar holding the item_id / owner of every FAISS position, written with the index
+META_PATH = INDEX_PATH + ".meta.npz"
+
+# HNSW graph parameters: neighbours per node, build-time and query-time beam widths
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Changes are persisted by a background writer, coalescing everything within this window
+SAVE_DEBOUNCE_SECONDS = 0.5
+
+# Deletes are tombstoned; the index is compacted once this fraction of it is dead
+COMPACT_DELETED_RATIO = 0.3
+
+# Sentinel owners in the position-aligned owner array
+UNOWNED = -1
+TOMBSTONED = -2
+
+faiss.omp_set_num_threads(os.cpu_count() or 1)
+
+# Use the GPU build of FAISS when a device is available
+USE_GPU = hasattr(faiss, "get_num_gpus") and faiss.get_num_gpus() > 0
+_gpu_resources = faiss.StandardGpuResources() if USE_GPU else None
+
+
+def _new_index():
+    """
+    Create an empty inner-product index: HNSW (sub-linear ANN search) on CPU, or an exact
+    flat index on GPU, where HNSW has no implementation and brute force is faster anyway.
+    """
+    if USE_GPU:
+        return faiss.index_cpu_to_gpu(_gpu_resources, 0, faiss.IndexFlatIP(EMBEDDING_DIM))
+
+    index = faiss.index_factory(EMBEDDING_DIM, f"HNSW{HNSW_M}", faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def embedding_to_bytes(embedding) -> bytes:
+    """Serialize an embedding as L2-normalized little-endian float32 bytes for the BLOB column."""
+    vec = np.asarray(embedding, dtype="<f4")
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec = vec / norm
+    return vec.astype("<f4").tobytes()
+
+
+def embedding_from_bytes(data: bytes) -> np.ndarray:
+    """Deserialize an embedding stored by embedding_to_bytes (zero-copy, read-only)."""
+    return np.frombuffer(data, dtype="<f4")
+
+
+def _rows_to_arrays(rows) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pack rows with id, user_id and embedding_bytes into (ids, owner_ids, matrix) arrays.
+    owner_ids uses -1 for items without an owner; matrix is a contiguous [N, 512] float32 copy.
+    """
+    rows = [row for row in rows if row.embedding_bytes]
+    ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+    owner_ids = np.fromiter((row.user_id or -1 for row in rows), dtype=np.int64, count=len(rows))
+    mat = np.frombuffer(b"".join(row.embedding_bytes for row in rows), dtype="<f4")
+    return ids, owner_ids, mat.reshape(len(rows), EMBEDDING_DIM).astype(np.float32, copy=True)
+
+
+def get_all_embeddings(db, *filters) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Load every stored embedding (optionally filtered) ordered by item id as
+    (ids, owner_ids, matrix), selecting only the columns the index needs.
+    """
+    rows = db.query(ClothingItem.id, ClothingItem.user_id, ClothingItem.embedding_bytes).filter(
+        ClothingItem.embedding_bytes.isnot(None), *filters
+    ).order_by(ClothingItem.id).all()
+    return _rows_to_arrays(rows)
 
 
 class EmbeddingIndex:
     """Manages FAISS index for clothing item embeddings with user isolation."""
 
+    # The classifier and embedding_to_bytes emit unit-length vectors, so callers' inputs are trusted as-is
+    assume_normalized: bool = True
+
     def __init__(self):
         self.index = None
         self.item_ids: list[int] = [] # Maps FAISS index to item_id
         self.user_map: dict[int, int] = {} # Maps item_id to user_id
+        self.user_positions: dict[int | None, list[int]] = {} # Maps user_id (None = unowned) to live FAISS positions
+        self._deleted_count = 0 # Tombstoned positions still present in the FAISS index
+        self._selectors: dict[int, tuple[int, object]] = {} # user_id -> (allowed count, FAISS selector), built lazily
+        # FAISS position -> item_id / owner, for vectorized hit filtering (over-allocated, len(item_ids) valid)
+        self._ids_arr = np.empty(0, dtype=np.int64)
+        self._owner_arr = np.empty(0, dtype=np.int64)
+        self._unsaved_changes = 0
+        self._norms_checked = False
+        self._compacting = False
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock() # Serializes disk writes; always taken before _lock
+        self._dirty = threading.Event()
         self._load_or_create()
+        threading.Thread(target=self._save_loop, daemon=True).start()
 
     def _load_or_create(self):
         """Load existing index or create a new one."""
         if os.path.exists(INDEX_PATH):
             self.index = faiss.read_index(INDEX_PATH)
+            if hasattr(self.index, "hnsw"):
+                self.index.hnsw.efSearch = HNSW_EF_SEARCH
+            elif USE_GPU:
+                self.index = faiss.index_cpu_to_gpu(_gpu_resources, 0, self.index)
             self._load_metadata()
         else:
-            self.index = faiss.IndexFlatIP(EMBEDDING_DIM)
+            self.index = _new_index()
             self.item_ids = []
             self.user_map = {}
+            self.user_positions = {}
 
     def _load_metadata(self):
-        """Load item IDs and user mapping from database."""
+        """Load item IDs and user mapping from the sidecar, or from the database if it is stale."""
+        if self._load_sidecar():
+            return
+
         db = SessionLocal()
         try:
-            items = db.query(ClothingItem).filter(
-                ClothingItem.embedding_json.isnot(None)
-            ).order_by(ClothingItem.id).all()
+            ids, owner_ids, mat = get_all_embeddings(db)
             
-            self.item_ids = [item.id for item in items]
-            
-            # Rebuild user map
-            self.user_map = {}
-            for item in items:
-                if item.user_id:
-                    self.user_map[item.id] = item.user_id
+            self.item_ids = ids.tolist()
+            self._reindex_positions(owner_ids)
                     
             # If item count mismatch (e.g. DB items deleted directly), 
             # we should ideally rebuild index. For now trust consistent state.
             if len(self.item_ids) != self.index.ntotal:
                  print(f"⚠️ Index mismatch: DB has {len(self.item_ids)} items, Index has {self.index.ntotal}. Rebuilding...")
-                 self._rebuild_all(items)
+                 self._rebuild_all(ids, owner_ids, mat)
+            elif hasattr(self.index, "hnsw") == USE_GPU:
+                 print(f"⚠️ Index on disk does not match the {'GPU flat' if USE_GPU else 'HNSW'} layout. Rebuilding...")
+                 self._rebuild_all(ids, owner_ids, mat)
                  
         finally:
             db.close()
 
-    def _rebuild_all(self, items):
-        """Rebuild index from scratch using provided items."""
-        self.index = faiss.IndexFlatIP(EMBEDDING_DIM)
+    def _load_sidecar(self) -> bool:
+        """
+        Restore item IDs, owners and tombstones from META_PATH. Returns False (so the caller
+        falls back to a full DB load) when the sidecar is missing or disagrees with the index or DB.
+        """
+        if not os.path.exists(META_PATH) or hasattr(self.index, "hnsw") == USE_GPU:
+            return False
+
+        with np.load(META_PATH) as meta:
+            ids, owner_ids = meta["ids"], meta["owner_ids"]
+        if len(ids) != self.index.ntotal:
+            return False
+
+        # Cheap aggregate check instead of loading every embedding: catches unsaved inserts and direct DB edits
+        live = ids[owner_ids != TOMBSTONED]
+        db = SessionLocal()
+        try:
+            count, max_id = db.query(func.count(ClothingItem.id), func.max(ClothingItem.id)).filter(
+                ClothingItem.embedding_bytes.isnot(None)
+            ).one()
+        finally:
+            db.close()
+        if count != len(live) or (max_id or 0) != (int(live.max()) if len(live) else 0):
+            return False
+
+        self.item_ids = ids.tolist()
+        # Tombstones are per position: a live item may share its id with a dead one
+        self._reindex_positions(owner_ids)
+        return True
+
+    def _rebuild_all(self, ids: np.ndarray, owner_ids: np.ndarray, mat: np.ndarray):
+        """Rebuild index from scratch using the provided embedding arrays."""
+        self.index = _new_index()
         self.item_ids = []
         self.user_map = {}
-        
-        for item in items:
-            if not item.embedding_json:
-                continue
-            embedding = json.loads(item.embedding_json)
-            vec = np.array([embedding], dtype=np.float32)
-            faiss.normalize_L2(vec)
-            self.index.add(vec)
-            self.item_ids.append(item.id)
-            if item.user_id:
-                self.user_map[item.id] = item.user_id
-                
-        self._save()
+        self.user_positions = {}
+        self._selectors = {}
+        self._deleted_count = 0
+        self._ids_arr = np.empty(0, dtype=np.int64)
+        self._owner_arr = np.empty(0, dtype=np.int64)
+        self._add_batch(ids, owner_ids, mat)
+        self._schedule_save()
 
-    def add_item(self, item_id: int, embedding: list[float], user_id: int = None):
-        """Add a single item embedding to the index."""
-        vec = np.array([embedding], dtype=np.float32)
-        faiss.normalize_L2(vec)
-        self.index.add(vec)
+    def _as_matrix(self, embeddings) -> np.ndarray:
+        """
+        Shape embeddings as a contiguous float32 [N, 512] matrix ready for FAISS,
+        normalizing (on a copy) only when inputs are not trusted to be unit-length.
+        """
+        if not self.assume_normalized:
+            mat = np.array(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+            faiss.normalize_L2(mat)
+            return mat
+
+        mat = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        if not self._norms_checked and len(mat):
+            # Verify the assumption once per process; fall back to normalizing if a producer breaks it
+            self._norms_checked = True
+            if not np.allclose(np.linalg.norm(mat, axis=1), 1.0, atol=1e-3):
+                print("⚠️ Embeddings are not unit-length; normalizing from now on")
+                self.assume_normalized = False
+                return self._as_matrix(mat)
+        return mat
+
+    def _add_batch(self, ids: np.ndarray, owner_ids: np.ndarray, mat: np.ndarray):
+        """Insert all embeddings with a single FAISS add."""
+        if len(ids) == 0:
+            return
+
+        self.index.add(self._as_matrix(mat))
+
+        self._reserve(len(ids))
+        for item_id, owner in zip(ids.tolist(), owner_ids.tolist()):
+            self._append(item_id, owner if owner > 0 else None)
+
+    def _reserve(self, n: int):
+        """Make room for n more positions in the id/owner arrays, growing geometrically."""
+        needed = len(self.item_ids) + n
+        if needed <= len(self._ids_arr):
+            return
+        capacity = max(needed, 2 * len(self._ids_arr), 64)
+        for name in ("_ids_arr", "_owner_arr"):
+            grown = np.empty(capacity, dtype=np.int64)
+            old = getattr(self, name)
+            grown[:len(old)] = old
+            setattr(self, name, grown)
+
+    def _append(self, item_id: int, user_id: int | None):
+        """Record the item that was just added at the next FAISS position."""
+        pos = len(self.item_ids)
+        self._reserve(1)
+        self._ids_arr[pos] = item_id
+        self._owner_arr[pos] = user_id or UNOWNED
+        self.user_positions.setdefault(user_id, []).append(pos)
+        self._invalidate_selectors(user_id)
         self.item_ids.append(item_id)
         if user_id:
             self.user_map[item_id] = user_id
-        self._save()
+
+    def _reindex_positions(self, owner_ids: np.ndarray):
+        """
+        Recompute the id/owner arrays, user_map and user_positions from item_ids and the
+        position-aligned owner_ids (UNOWNED / TOMBSTONED sentinels included).
+        """
+        self._ids_arr = np.array(self.item_ids, dtype=np.int64)
+        self._owner_arr = np.array(owner_ids, dtype=np.int64)
+        self._deleted_count = int(np.count_nonzero(self._owner_arr == TOMBSTONED))
+
+        self.user_map = {}
+        self.user_positions = {}
+        self._selectors = {}
+        for pos, (item_id, owner) in enumerate(zip(self.item_ids, self._owner_arr.tolist())):
+            if owner == TOMBSTONED:
+                continue
+            if owner > 0:
+                self.user_map[item_id] = owner
+            self.user_positions.setdefault(owner if owner > 0 else None, []).append(pos)
+
+    def _invalidate_selectors(self, user_id: int | None):
+        """Drop cached selectors covering user_id's positions; unowned positions are in every user's."""
+        if user_id is None:
+            self._selectors.clear()
+        else:
+            self._selectors.pop(user_id, None)
+
+    def _user_selector(self, user_id: int) -> tuple[int, object]:
+        """Return (allowed count, FAISS selector) over user_id's live and unowned positions (caller holds _lock)."""
+        cached = self._selectors.get(user_id)
+        if cached is None:
+            allowed = np.array(
+                self.user_positions.get(user_id, []) + self.user_positions.get(None, []), dtype=np.int64
+            )
+            cached = (len(allowed), faiss.IDSelectorBatch(allowed) if len(allowed) else None)
+            self._selectors[user_id] = cached
+        return cached
+
+    def bulk_add(self, items):
+        """Add many ClothingItem rows to the index in one batch."""
+        ids, owner_ids, mat = _rows_to_arrays(items)
+        with self._lock:
+            self._add_batch(ids, owner_ids, mat)
+            self._schedule_save()
+
+    def add_item(self, item_id: int, embedding: np.ndarray, user_id: int = None):
+        """Add a single item embedding to the index."""
+        vec = self._as_matrix(embedding)
+        with self._lock:
+            self.index.add(vec)
+            self._append(item_id, user_id or None)
+            self._schedule_save()
 
     def remove_item(self, item_id: int):
-        """Remove an item and rebuild the index."""
-        if item_id in self.item_ids:
-            self._rebuild_without(item_id)
-        if item_id in self.user_map:
-            del self.user_map[item_id]
-
-    def _rebuild_without(self, exclude_id: int):
-        """Rebuild the entire index excluding a specific item."""
-        db = SessionLocal()
+        """Tombstone an item; the index is compacted in the background once enough items are deleted."""
+        with self._lock:
+            # SQLite can reuse a deleted item's id, so only tombstone positions that are still live
+            n = len(self.item_ids)
+            owners = self._owner_arr[:n]
+            for pos in np.flatnonzero((self._ids_arr[:n] == item_id) & (owners != TOMBSTONED)).tolist():
+                owner = int(owners[pos])
+                self.user_positions[owner if owner > 0 else None].remove(pos)
+                self._invalidate_selectors(owner if owner > 0 else None)
+                owners[pos] = TOMBSTONED
+                self._deleted_count += 1
+            self.user_map.pop(item_id, None)
+            self._schedule_save()
+
+            ntotal = self.index.ntotal
+            if ntotal and self._deleted_count / ntotal > COMPACT_DELETED_RATIO and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self._compact, daemon=True).start()
+
+    def _compact(self):
+        """Rebuild the index without tombstoned vectors, then swap it in."""
         try:
-            items = db.query(ClothingItem).filter(
-                ClothingItem.embedding_json.isnot(None),
-                ClothingItem.id != exclude_id
-            ).order_by(ClothingItem.id).all()
-            
-            self._rebuild_all(items)
+            with self._lock:
+                snapshot = self.index.ntotal
+                vecs = self.index.reconstruct_n(0, snapshot)
+                keep = np.flatnonzero(self._owner_arr[:snapshot] != TOMBSTONED)
+
+            # Build the replacement without holding the lock so searches keep running
+            new_index = _new_index()
+            if len(keep):
+                new_index.add(vecs[keep])
+
+            with self._lock:
+                # Carry over anything added while the replacement was being built
+                ntotal = self.index.ntotal
+                if ntotal > snapshot:
+                    new_index.add(self.index.reconstruct_n(snapshot, ntotal - snapshot))
+                positions = np.concatenate([keep, np.arange(snapshot, ntotal)])
+                # Current owners, so positions tombstoned during the rebuild stay tombstoned
+                owner_ids = self._owner_arr[positions]
+                self.index = new_index
+                self.item_ids = self._ids_arr[positions].tolist()
+                self._reindex_positions(owner_ids)
+                self._schedule_save()
         finally:
-            db.close()
+            self._compacting = False
 
-    def search_similar(self, embedding: list[float], k: int = 10, exclude_id: int = None, user_id: int = None) -> list[tuple[int, float]]:
+    def search_similar(self, embedding: np.ndarray, k: int = 10, exclude_id: int = None, user_id: int = None) -> list[tuple[int, float]]:
         """
         Search for similar items by embedding, optionally filtered by user_id.
         """
-        if self.index.ntotal == 0:
-            return []
+        return self.search_similar_batch(
+            np.asarray(embedding, dtype=np.float32).reshape(1, -1), k=k, exclude_ids=[exclude_id], user_id=user_id
+        )[0]
 
-        vec = np.array([embedding], dtype=np.float32)
-        faiss.normalize_L2(vec)
+    def search_similar_batch(
+        self, embeddings, k: int = 10, exclude_ids: list[int] = None, user_id: int = None
+    ) -> list[list[tuple[int, float]]]:
+        """
+        Search for several query embeddings in one FAISS call (one result list per query),
+        optionally filtered by user_id. exclude_ids gives an item to skip per query.
+        """
+        mat = self._as_matrix(embeddings)
+        if exclude_ids is None:
+            exclude_ids = [None] * len(mat)
 
-        # Search more candidates to allow for filtering
-        search_k = min(k * 10, self.index.ntotal)
-        scores, indices = self.index.search(vec, search_k)
+        with self._lock:
+            if self.index.ntotal == 0:
+                return [[] for _ in range(len(mat))]
 
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < 0 or idx >= len(self.item_ids):
-                continue
-                
-            item_id = self.item_ids[idx]
-            
-            # User isolation filter
-            if user_id is not None:
-                item_owner = self.user_map.get(item_id)
-                # If item has owner and it's different, skip
-                if item_owner is not None and item_owner != user_id:
-                    continue
-                # If item has no owner (legacy public items), maybe include? 
-                # For now, let's say strict mode: only user's items.
-                if item_owner is None:
-                     # Decide policy: public items visible? Let's say yes for now to not break legacy
-                     pass
-
-            if exclude_id and item_id == exclude_id:
-                continue
-                
-            results.append((item_id, float(score)))
-            if len(results) >= k:
-                break
+            params = None
+            if user_id is not None and not USE_GPU:
+                # Let FAISS skip other users' vectors internally (unowned legacy items stay visible)
+                n_allowed, selector = self._user_selector(user_id)
+                if n_allowed == 0:
+                    return [[] for _ in range(len(mat))]
+                # Tombstones are not in user_positions, so only the excluded item can still be dropped
+                search_k = min(k + 1, n_allowed)
+                params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(HNSW_EF_SEARCH, search_k))
+            else:
+                # Search more candidates to allow for filtering
+                search_k = min(k * 10, self.index.ntotal)
+            scores, indices = self.index.search(mat, search_k, params=params)
+
+            # Filter while holding the lock so the id/owner arrays stay aligned with the index
+            return [
+                self._filter_hits(row_scores, row_indices, k, exclude_id, user_id)
+                for row_scores, row_indices, exclude_id in zip(scores, indices, exclude_ids)
+            ]
+
+    def _filter_hits(self, scores, indices, k, exclude_id, user_id) -> list[tuple[int, float]]:
+        """Map one row of FAISS hits to (item_id, score), applying deletion, user and exclude filters."""
+        valid = (indices >= 0) & (indices < len(self.item_ids))
+        positions = indices[valid]
+        item_ids = self._ids_arr[positions]
+        owners = self._owner_arr[positions]
+
+        keep = owners != TOMBSTONED
+        if user_id is not None:
+            # Unowned legacy items stay visible to every user
+            keep &= (owners == user_id) | (owners == UNOWNED)
+        if exclude_id:
+            keep &= item_ids != exclude_id
+
+        return list(zip(item_ids[keep][:k].tolist(), scores[valid][keep][:k].tolist()))
+
+    def _schedule_save(self):
+        """Mark the index dirty; the background writer persists it shortly after."""
+        self._unsaved_changes += 1
+        self._dirty.set()
+
+    def _save_loop(self):
+        """Background writer: wait for changes, let a burst settle, then persist once."""
+        while True:
+            self._dirty.wait()
+            time.sleep(SAVE_DEBOUNCE_SECONDS)
+            self._dirty.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Failed to save FAISS index: {e}")
+
+    def flush(self):
+        """Persist any changes not yet written to disk."""
+        with self._write_lock:
+            with self._lock:
+                saved_changes = self._unsaved_changes
+                if not saved_changes:
+                    return
+                snapshot = self._snapshot()
+            # Only the copy is written, so inserts and searches continue meanwhile
+            self._write(*snapshot)
+            with self._lock:
+                # Count as saved only once the write succeeded; later changes stay pending
+                self._unsaved_changes -= saved_changes
+
+    def _snapshot(self):
+        """Copy the index and position metadata (caller holds _lock)."""
+        n = len(self.item_ids)
+        index = faiss.index_gpu_to_cpu(self.index) if USE_GPU else faiss.clone_index(self.index)
+        return index, self._ids_arr[:n].copy(), self._owner_arr[:n].copy()
 
-        return results
+    def _write(self, index, ids: np.ndarray, owner_ids: np.ndarray):
+        """Write the FAISS index and its metadata sidecar, each via a temp file and atomic rename."""
+        faiss.write_index(index, INDEX_PATH + ".tmp")
+        os.replace(INDEX_PATH + ".tmp", INDEX_PATH)
 
-    def _save(self):
-        """Persist the FAISS index to disk."""
-        faiss.write_index(self.index, INDEX_PATH)
+        with open(META_PATH + ".tmp", "wb") as f:
+            np.savez(f, ids=ids, owner_ids=owner_ids)
+        os.replace(META_PATH + ".tmp", META_PATH)
 
 
 # Singleton instance
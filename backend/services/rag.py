@@ -4,27 +4,17 @@ Loads curated fashion guidance, embeds chunks with CLIP text encoder,
 and retrieves relevant context for LLM outfit recommendations.
 """
 import os
+import hashlib
 import numpy as np
-import torch
-from transformers import CLIPModel, CLIPProcessor
+# Reuse the classifier's CLIP instance (same checkpoint, device and dtype) instead of loading a second copy
+from services.classifier import MODEL_NAME, get_text_embeddings
 
 KNOWLEDGE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "knowledge")
-MODEL_NAME = "openai/clip-vit-base-patch32"
 
 _chunks: list[str] = []
 _chunk_embeddings: np.ndarray | None = None
 
 
-def _get_text_embedding(text: str, model, processor) -> np.ndarray:
-    """Get CLIP text embedding for a string."""
-    inputs = processor(text=text, return_tensors="pt", padding=True, truncation=True, max_length=77)
-    with torch.no_grad():
-        outputs = model.get_text_features(**inputs)
-    vec = outputs[0].cpu().numpy()
-    vec = vec / np.linalg.norm(vec)
-    return vec
-
-
 def _load_and_embed_knowledge():
     """Load fashion knowledge base and create embeddings for each chunk."""
     global _chunks, _chunk_embeddings
@@ -47,17 +37,25 @@ def _load_and_embed_knowledge():
     if not _chunks:
         return
 
-    # Load CLIP model for text embeddings
-    model = CLIPModel.from_pretrained(MODEL_NAME)
-    processor = CLIPProcessor.from_pretrained(MODEL_NAME)
-    model.eval()
-
-    embeddings = []
-    for chunk in _chunks:
-        emb = _get_text_embedding(chunk, model, processor)
-        embeddings.append(emb)
-
-    _chunk_embeddings = np.stack(embeddings, axis=0)
+    # Embeddings are cached on disk, keyed by the knowledge text and model
+    digest = hashlib.sha1(f"{MODEL_NAME}\n{text}".encode()).hexdigest()
+    cache_file = os.path.join(KNOWLEDGE_DIR, f"fashion_guide.{digest}.npy")
+    if os.path.exists(cache_file):
+        try:
+            cached = np.load(cache_file, mmap_mode="r")
+            if len(cached) == len(_chunks):
+                _chunk_embeddings = cached
+                print(f"Loaded {len(_chunks)} fashion knowledge chunks (cached embeddings)")
+                return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable embedding cache {cache_file}: {e}")
+
+    _chunk_embeddings = get_text_embeddings(_chunks)
+    # Write to a temp file and swap it in, so a crash mid-write never leaves a truncated cache
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        np.save(f, _chunk_embeddings)
+    os.replace(tmp_file, cache_file)
     print(f"Loaded {len(_chunks)} fashion knowledge chunks")
 
 
@@ -71,12 +69,13 @@ def retrieve_fashion_context(query: str, top_k: int = 5) -> list[str]:
     if not _chunks or _chunk_embeddings is None:
         return []
 
-    model = CLIPModel.from_pretrained(MODEL_NAME)
-    processor = CLIPProcessor.from_pretrained(MODEL_NAME)
-    model.eval()
-
-    query_emb = _get_text_embedding(query, model, processor)
-    scores = np.dot(_chunk_embeddings, query_emb)
+    query_emb = get_text_embeddings([query])[0]
+    scores = _chunk_embeddings @ query_emb
 
-    top_indices = np.argsort(scores)[-top_k:][::-1]
+    # Partial selection is O(N); only the top_k winners get sorted
+    if len(scores) > top_k:
+        candidates = np.argpartition(scores, -top_k)[-top_k:]
+    else:
+        candidates = np.arange(len(scores))
+    top_indices = candidates[np.argsort(scores[candidates])[::-1]]
     return [_chunks[i] for i in top_indices if scores[i] > 0.1]
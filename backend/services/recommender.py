@@ -4,7 +4,7 @@ Combines wardrobe data, weather context, occasion, FAISS similarity search,
 RAG fashion knowledge, and Gemini LLM to generate outfit suggestions.
 """
 import os
-import json
+import orjson
 import google.generativeai as genai
 from dotenv import load_dotenv
 from models.database import SessionLocal, ClothingItem
@@ -14,6 +14,12 @@ from services.embeddings import get_embedding_index
 
 load_dotenv()
 
+# The only ClothingItem columns the summary and fallback read; skips the embedding columns
+ITEM_COLUMNS = (
+    ClothingItem.id, ClothingItem.name, ClothingItem.category, ClothingItem.color,
+    ClothingItem.pattern, ClothingItem.fabric, ClothingItem.season, ClothingItem.occasion_tags,
+)
+
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
@@ -47,7 +53,8 @@ def get_outfit_recommendations(
         close_db = True
 
     try:
-        query = db.query(ClothingItem)
+        # Plain rows with attribute access, no ORM object hydration
+        query = db.query(ClothingItem).with_entities(*ITEM_COLUMNS)
         if user_id:
             query = query.filter(ClothingItem.user_id == user_id)
         
@@ -93,8 +100,12 @@ def get_outfit_recommendations(
 def _build_wardrobe_summary(items: list[ClothingItem]) -> str:
     """Build a text summary of the user's wardrobe for the LLM prompt."""
     lines = []
+    # Most items share one of a few tag lists, so each distinct JSON string is parsed once
+    parsed_tags: dict[str, list[str]] = {}
     for item in items:
-        tags = json.loads(item.occasion_tags) if item.occasion_tags else []
+        tags = parsed_tags.get(item.occasion_tags) if item.occasion_tags else []
+        if tags is None:
+            tags = parsed_tags[item.occasion_tags] = orjson.loads(item.occasion_tags)
         line = f"- ID:{item.id} | {item.color} {item.pattern} {item.category} | {item.fabric} | Season: {item.season} | Occasions: {', '.join(tags)}"
         if item.name:
             line = f"- ID:{item.id} \"{item.name}\" | {item.color} {item.pattern} {item.category} | {item.fabric} | Season: {item.season} | Occasions: {', '.join(tags)}"
@@ -167,7 +178,7 @@ Respond in valid JSON format ONLY. Use this exact structure:
                 text = text[:-3]
             text = text.strip()
 
-        result = json.loads(text)
+        result = orjson.loads(text)
         return result.get("outfits", [])
     except Exception as e:
         print(f"Gemini API error: {e}")
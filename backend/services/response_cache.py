@@ -0,0 +1,173 @@
+"""
+In-memory TTL + LRU caches for expensive API responses: an exact-key cache for
+per-user responses (outfit recommendations and shopping suggestions) and a
+semantic cache that also serves near-duplicate queries.
+"""
+import time
+import threading
+import itertools
+from collections import OrderedDict
+import numpy as np
+
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_MAX_ENTRIES = 1024
+
+
+class QueryCache:
+    """Thread-safe LRU cache with per-entry expiry, keyed by tuples."""
+
+    def __init__(self, ttl: float = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[float, object]] = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple):
+        """Return the cached value for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: tuple, value):
+        """Store a value, evicting the least recently used entry when full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: tuple):
+        """Drop a single entry if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id: int):
+        """
+        Drop every cached response belonging to a user (e.g. after their wardrobe changes).
+        Assumes per-user keys are tuples whose first element is the user_id.
+        """
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+class SemanticCache:
+    """
+    Thread-safe cache keyed by a vector: a lookup returns the value of the most similar stored
+    vector if its cosine similarity reaches the threshold. Random-projection LSH (several short
+    hash tables) narrows candidates to likely neighbours. Vectors must be L2-normalized;
+    the scope must match exactly.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        threshold: float = 0.95,
+        n_tables: int = 4,
+        n_bits: int = 8,
+        ttl: float = DEFAULT_TTL_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        seed: int = 0,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._planes = np.random.default_rng(seed).standard_normal((n_tables * n_bits, dim)).astype(np.float32)
+        self._n_tables = n_tables
+        self._bit_weights = 1 << np.arange(n_bits, dtype=np.int64)
+        self._entries: OrderedDict[int, tuple[float, np.ndarray, object, list[tuple]]] = OrderedDict()
+        self._buckets: dict[tuple, set[int]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def _bucket_keys(self, scope, vector: np.ndarray) -> list[tuple]:
+        """One (scope, table, signature) bucket key per hash table."""
+        bits = (self._planes @ vector > 0).reshape(self._n_tables, -1)
+        return [(scope, table, sig) for table, sig in enumerate((bits @ self._bit_weights).tolist())]
+
+    def get(self, scope, vector: np.ndarray):
+        """Return the value cached for the nearest vector within the threshold, or None."""
+        with self._lock:
+            candidates = set()
+            for key in self._bucket_keys(scope, vector):
+                candidates |= self._buckets.get(key, set())
+
+            now = time.monotonic()
+            live = []
+            for entry_id in candidates:
+                if now - self._entries[entry_id][0] > self.ttl:
+                    self._evict(entry_id)
+                else:
+                    live.append(entry_id)
+
+            best_id = None
+            if live:
+                # Score every candidate with one matrix-vector product
+                scores = np.stack([self._entries[entry_id][1] for entry_id in live]) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    best_id = live[best]
+
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][2]
+
+    def set(self, scope, vector: np.ndarray, value):
+        """Store a value under a vector, evicting the least recently used entry when full."""
+        with self._lock:
+            entry_id = next(self._ids)
+            keys = self._bucket_keys(scope, vector)
+            self._entries[entry_id] = (time.monotonic(), vector, value, keys)
+            for key in keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def _evict(self, entry_id: int):
+        _, _, _, keys = self._entries.pop(entry_id)
+        for key in keys:
+            bucket = self._buckets[key]
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+# Singleton instance
+response_cache = QueryCache()
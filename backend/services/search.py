@@ -3,12 +3,32 @@ Image search service using DuckDuckGo.
 """
 from ddgs import DDGS
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import os
 import uuid
 import shutil
+from urllib.parse import urlparse
 
 import re
-import json
+import orjson
+from services.response_cache import QueryCache
+
+# Shared keep-alive session so repeated requests skip the TCP/TLS handshake
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+IMAGE_EXTENSIONS = {".png", ".webp", ".jpg", ".jpeg"}
+
+# DuckDuckGo VQD tokens are tied to a query and stay valid for a while — reuse them
+_VQD_RE = re.compile(rb'vqd=([\'"]?)([\d-]+)\1')
+VQD_TTL_SECONDS = 1800
+_vqd_cache = QueryCache(ttl=VQD_TTL_SECONDS, max_entries=1024)
 
 def search_images_fallback(query: str, max_results: int = 10) -> list[str]:
     """Fallback search using requests directly."""
@@ -17,14 +37,18 @@ def search_images_fallback(query: str, max_results: int = 10) -> list[str]:
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
     }
     try:
-        # 1. Get VQD
-        resp = requests.get(f"https://duckduckgo.com/?q={query}&t=h_&iax=images&ia=images", headers=headers, timeout=10)
-        resp.raise_for_status()
-        vqd_match = re.search(r'vqd=([\'"]?)([\d-]+)\1', resp.text)
-        if not vqd_match:
-            print("Fallback: Could not find VQD")
-            return []
-        vqd = vqd_match.group(2)
+        # 1. Get VQD (cached per query)
+        vqd = _vqd_cache.get((query,))
+        if vqd is None:
+            resp = _session.get(f"https://duckduckgo.com/?q={query}&t=h_&iax=images&ia=images", headers=headers, timeout=10)
+            resp.raise_for_status()
+            # Match on raw bytes to skip decoding the whole HTML page
+            vqd_match = _VQD_RE.search(resp.content)
+            if not vqd_match:
+                print("Fallback: Could not find VQD")
+                return []
+            vqd = vqd_match.group(2).decode()
+            _vqd_cache.set((query,), vqd)
 
         # 2. Get Images
         params = {
@@ -35,13 +59,14 @@ def search_images_fallback(query: str, max_results: int = 10) -> list[str]:
             "f": ",,,",
             "p": "1"
         }
-        resp = requests.get("https://duckduckgo.com/i.js", params=params, headers=headers, timeout=10)
+        resp = _session.get("https://duckduckgo.com/i.js", params=params, headers=headers, timeout=10)
         resp.raise_for_status()
-        data = resp.json()
+        data = orjson.loads(resp.content)
         results = data.get("results", [])
         return [r["image"] for r in results[:max_results]]
     except Exception as e:
         print(f"Fallback search error: {e}")
+        _vqd_cache.delete((query,))
         return []
 
 def search_images(query: str, max_results: int = 10) -> list[str]:
@@ -76,22 +101,27 @@ def search_images(query: str, max_results: int = 10) -> list[str]:
 def download_image(url: str, save_dir: str) -> str:
     """Download image from URL and save to directory. Returns local filepath."""
     try:
-        response = requests.get(url, stream=True, timeout=10)
-        response.raise_for_status()
-        
-        # Guess extension or default to .jpg
-        ext = ".jpg"
-        if "png" in url.lower(): ext = ".png"
-        elif "webp" in url.lower(): ext = ".webp"
-        elif "jpeg" in url.lower(): ext = ".jpg"
-            
-        filename = f"{uuid.uuid4().hex}{ext}"
-        filepath = os.path.join(save_dir, filename)
-        
-        with open(filepath, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-                
+        with _session.get(url, stream=True, timeout=10) as response:
+            response.raise_for_status()
+
+            # Take the extension from the URL path, default to .jpg
+            ext = os.path.splitext(urlparse(url).path)[1].lower()
+            if ext not in IMAGE_EXTENSIONS:
+                ext = ".jpg"
+
+            filename = f"{uuid.uuid4().hex}{ext}"
+            filepath = os.path.join(save_dir, filename)
+
+            # Copy the raw stream in C with a 64KB buffer; undo any gzip/deflate transfer encoding
+            response.raw.decode_content = True
+            with open(filepath, "wb") as f:
+                shutil.copyfileobj(response.raw, f, length=DOWNLOAD_CHUNK_SIZE)
+
         return filepath
     except Exception as e:
         raise Exception(f"Failed to download image: {str(e)}")
+
+def download_images(urls: list[str], save_dir: str) -> list[str]:
+    """Download several images concurrently. Returns local filepaths in input order."""
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+        return list(pool.map(lambda url: download_image(url, save_dir), urls))
@@ -4,12 +4,20 @@ Identifies gaps in the user's wardrobe and recommends items to purchase
 using embedding analysis and Gemini LLM.
 """
 import os
-import json
+import zlib
+import string
+import hashlib
+from functools import lru_cache
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import orjson
 import google.generativeai as genai
 from dotenv import load_dotenv
+from sqlalchemy import func
 from models.database import SessionLocal, ClothingItem
 from services.rag import retrieve_fashion_context
+from services.response_cache import QueryCache, SemanticCache
 
 load_dotenv()
 
@@ -28,25 +36,97 @@ ESSENTIAL_CATEGORIES = {
 
 ESSENTIAL_COLORS = ["black", "white", "navy blue", "grey", "beige", "brown"]
 
+# Constant-folded forms of the tables above, used by _identify_gaps
+_ESSENTIALS_BY_FOCUS = {focus: frozenset(cats) for focus, cats in ESSENTIAL_CATEGORIES.items()}
+_ALL_ESSENTIALS = frozenset().union(*ESSENTIAL_CATEGORIES.values())
+_ESSENTIAL_COLORS_SET = frozenset(ESSENTIAL_COLORS)
+_TOPS = ("t-shirt", "shirt", "blouse", "sweater", "hoodie", "tank top", "cardigan")
+_BOTTOMS = ("jeans", "pants", "shorts", "skirt")
+_SHOES = ("sneakers", "boots", "sandals", "heels")
+
+# Gemini suggestions only depend on the wardrobe composition, so identical analyses reuse them
+SUGGESTION_CACHE_TTL_SECONDS = 24 * 60 * 60
+_suggestion_cache = QueryCache(ttl=SUGGESTION_CACHE_TTL_SECONDS, max_entries=4096)
+
+# Near-identical wardrobes (e.g. one more shirt) with the same gaps reuse suggestions too
+ANALYSIS_VECTOR_DIM = 128
+_similar_suggestion_cache = SemanticCache(
+    ANALYSIS_VECTOR_DIM, threshold=0.95, ttl=SUGGESTION_CACHE_TTL_SECONDS, max_entries=4096
+)
+
+# Gemini shopping prompt, split so the part shared across users comes first: the prefix depends
+# only on the occasion focus and its fashion guidance, the suffix on the user's wardrobe
+_PROMPT_PREFIX_TEMPLATE = """You are a personal fashion advisor. Based on the user's current wardrobe analysis and identified gaps (given after these instructions), suggest specific items to purchase.
+
+{focus}
+
+{guidance}
+
+Suggest 3-5 specific items to purchase. For each, explain why it would complement the existing wardrobe.
+
+Respond in valid JSON format ONLY:
+{{
+  "suggestions": [
+    {{
+      "item": "Item description (e.g., 'Navy wool blazer')",
+      "category": "category name",
+      "reason": "Why this item fills a gap in the wardrobe",
+      "priority": "high/medium/low",
+      "estimated_price_range": "$XX - $XX"
+    }}
+  ]
+}}
+"""
+_PROMPT_SUFFIX_TEMPLATE = """
+CURRENT WARDROBE ANALYSIS:
+- Total items: {total_items}
+- Categories: {categories}
+- Colors: {colors}
+- Seasons: {seasons}
+
+IDENTIFIED GAPS:
+{gaps}"""
+# Parsed once into (literal, slot) segments so rendering is a single join
+_PROMPT_PREFIX_SEGMENTS = tuple((lit, slot) for lit, slot, _, _ in string.Formatter().parse(_PROMPT_PREFIX_TEMPLATE))
+_PROMPT_SUFFIX_SEGMENTS = tuple((lit, slot) for lit, slot, _, _ in string.Formatter().parse(_PROMPT_SUFFIX_TEMPLATE))
+
+# Upper bound on concurrent Gemini calls when several focus areas are requested at once
+GEMINI_BATCH_WORKERS = 4
+
 
 def analyze_wardrobe_gaps(occasion_focus: str = None, user_id: int = None, db: SessionLocal = None) -> dict:
     """
     Analyze the user's wardrobe for gaps and generate shopping suggestions.
     """
+    return analyze_wardrobe_gaps_multi([occasion_focus], user_id=user_id, db=db)[occasion_focus]
+
+
+def analyze_wardrobe_gaps_multi(
+    focuses: list[str | None], user_id: int = None, db: SessionLocal = None
+) -> dict[str | None, dict]:
+    """
+    Analyze the user's wardrobe once and generate shopping suggestions for several
+    occasion focuses, with the Gemini calls for all focuses in flight together.
+    Returns one analyze_wardrobe_gaps result per focus.
+    """
     close_db = False
     if db is None:
         db = SessionLocal()
         close_db = True
 
     try:
-        query = db.query(ClothingItem)
-        if user_id:
-            query = query.filter(ClothingItem.user_id == user_id)
-            
-        items = query.all()
-
-        if not items:
-            return {
+        filters = [ClothingItem.user_id == user_id] if user_id else []
+
+        # Analyze what the user has
+        analysis = _analyze_existing_wardrobe(db, *filters)
+    finally:
+        if close_db:
+            db.close()
+
+    focuses = list(dict.fromkeys(focuses))
+    if not analysis["total_items"]:
+        return {
+            focus: {
                 "gaps": ["Your wardrobe is empty!"],
                 "suggestions": [],
                 "analysis": {
@@ -54,55 +134,63 @@ def analyze_wardrobe_gaps(occasion_focus: str = None, user_id: int = None, db: S
                     "message": "Start by uploading some clothing items to get personalized suggestions.",
                 },
             }
+            for focus in focuses
+        }
 
-        # Analyze what the user has
-        analysis = _analyze_existing_wardrobe(items)
-
-        # Identify gaps
-        gaps = _identify_gaps(analysis, occasion_focus)
-
-        # Generate suggestions
-        suggestion_gaps = gaps[:5] # Limit context window
-        if GEMINI_API_KEY:
-            # We call internal function but need to pass full args if we change signature there too?
-            # _generate_shopping_suggestions takes analysis and gaps.
-            suggestions = _generate_shopping_suggestions(analysis, gaps, occasion_focus)
-        else:
-            suggestions = _fallback_suggestions(gaps)
+    # Identify gaps
+    gaps_by_focus = [_identify_gaps(analysis, focus) for focus in focuses]
+
+    # Generate suggestions
+    if GEMINI_API_KEY and len(focuses) > 1:
+        with ThreadPoolExecutor(max_workers=min(GEMINI_BATCH_WORKERS, len(focuses))) as pool:
+            all_suggestions = list(pool.map(
+                lambda args: _generate_shopping_suggestions(analysis, *args), zip(gaps_by_focus, focuses)
+            ))
+    elif GEMINI_API_KEY and focuses:
+        all_suggestions = [_generate_shopping_suggestions(analysis, gaps_by_focus[0], focuses[0])]
+    else:
+        all_suggestions = [_fallback_suggestions(gaps) for gaps in gaps_by_focus]
 
-        return {
+    return {
+        focus: {
             "gaps": gaps,
             "suggestions": suggestions,
             "analysis": analysis,
         }
-    finally:
-        if close_db:
-            db.close()
-
+        for focus, gaps, suggestions in zip(focuses, gaps_by_focus, all_suggestions)
+    }
 
-def _analyze_existing_wardrobe(items: list[ClothingItem]) -> dict:
-    """Analyze the existing wardrobe composition."""
-    categories = Counter(item.category for item in items)
-    colors = Counter(item.color for item in items)
-    seasons = Counter(item.season for item in items)
-    fabrics = Counter(item.fabric for item in items)
 
-    occasion_tags = []
-    for item in items:
-        if item.occasion_tags:
-            try:
-                tags = json.loads(item.occasion_tags)
-                occasion_tags.extend(tags)
-            except json.JSONDecodeError:
-                pass
-    occasions = Counter(occasion_tags)
+def _analyze_existing_wardrobe(db, *filters) -> dict:
+    """
+    Analyze the existing wardrobe composition. Counting happens in SQL with GROUP BY,
+    so only one row per distinct value is transferred instead of every item.
+    """
+    def count_by(column) -> dict:
+        return dict(db.query(column, func.count(ClothingItem.id)).filter(*filters).group_by(column).all())
+
+    total_items = db.query(func.count(ClothingItem.id)).filter(*filters).scalar() or 0
+    if not total_items:
+        return {"total_items": 0}
+
+    # Identical tag lists are grouped too, so each distinct JSON string is parsed once
+    occasions = Counter()
+    tag_rows = db.query(ClothingItem.occasion_tags, func.count(ClothingItem.id)).filter(
+        ClothingItem.occasion_tags.isnot(None), *filters
+    ).group_by(ClothingItem.occasion_tags).all()
+    for occasion_tags, count in tag_rows:
+        try:
+            for tag in orjson.loads(occasion_tags):
+                occasions[tag] += count
+        except orjson.JSONDecodeError:
+            pass
 
     return {
-        "total_items": len(items),
-        "categories": dict(categories),
-        "colors": dict(colors),
-        "seasons": dict(seasons),
-        "fabrics": dict(fabrics),
+        "total_items": total_items,
+        "categories": count_by(ClothingItem.category),
+        "colors": count_by(ClothingItem.color),
+        "seasons": count_by(ClothingItem.season),
+        "fabrics": count_by(ClothingItem.fabric),
         "occasions": dict(occasions),
     }
 
@@ -110,23 +198,18 @@ def _analyze_existing_wardrobe(items: list[ClothingItem]) -> dict:
 def _identify_gaps(analysis: dict, occasion_focus: str = None) -> list[str]:
     """Identify wardrobe gaps based on analysis."""
     gaps = []
-    existing_categories = set(analysis["categories"].keys())
-    existing_colors = set(analysis["colors"].keys())
+    existing_categories = analysis["categories"].keys()
+    existing_colors = analysis["colors"].keys()
 
     # Check for missing essential categories
-    all_essentials = set()
-    if occasion_focus and occasion_focus in ESSENTIAL_CATEGORIES:
-        all_essentials = set(ESSENTIAL_CATEGORIES[occasion_focus])
-    else:
-        for cats in ESSENTIAL_CATEGORIES.values():
-            all_essentials.update(cats)
+    all_essentials = _ESSENTIALS_BY_FOCUS.get(occasion_focus, _ALL_ESSENTIALS)
 
     missing_categories = all_essentials - existing_categories
     for cat in missing_categories:
         gaps.append(f"Missing clothing type: {cat}")
 
     # Check for missing essential/neutral colors
-    missing_colors = set(ESSENTIAL_COLORS) - existing_colors
+    missing_colors = _ESSENTIAL_COLORS_SET - existing_colors
     if len(missing_colors) >= 3:
         gaps.append(f"Limited neutral colors — consider adding: {', '.join(list(missing_colors)[:3])}")
 
@@ -137,9 +220,9 @@ def _identify_gaps(analysis: dict, occasion_focus: str = None) -> list[str]:
         gaps.append("No spring/summer items — you may need lighter clothing")
 
     # Check category balance
-    tops_count = sum(analysis["categories"].get(c, 0) for c in ["t-shirt", "shirt", "blouse", "sweater", "hoodie", "tank top", "cardigan"])
-    bottoms_count = sum(analysis["categories"].get(c, 0) for c in ["jeans", "pants", "shorts", "skirt"])
-    shoes_count = sum(analysis["categories"].get(c, 0) for c in ["sneakers", "boots", "sandals", "heels"])
+    tops_count = sum(analysis["categories"].get(c, 0) for c in _TOPS)
+    bottoms_count = sum(analysis["categories"].get(c, 0) for c in _BOTTOMS)
+    shoes_count = sum(analysis["categories"].get(c, 0) for c in _SHOES)
 
     if tops_count > 0 and bottoms_count == 0:
         gaps.append("No bottoms in your wardrobe — add pants, jeans, or skirts")
@@ -154,61 +237,139 @@ def _identify_gaps(analysis: dict, occasion_focus: str = None) -> list[str]:
     return gaps
 
 
+def _wardrobe_fingerprint(analysis: dict, gaps: list[str], occasion_focus: str = None) -> str:
+    """Stable hash of everything that goes into the Gemini shopping prompt."""
+    payload = orjson.dumps(
+        {"a": analysis, "g": sorted(gaps), "o": occasion_focus},
+        option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+    )
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def _analysis_vector(analysis: dict) -> np.ndarray:
+    """Hash the wardrobe composition counters into a fixed-length, L2-normalized vector."""
+    vec = np.zeros(ANALYSIS_VECTOR_DIM, dtype=np.float32)
+    for field in ("categories", "colors", "seasons", "fabrics", "occasions"):
+        for name, count in analysis[field].items():
+            vec[zlib.crc32(f"{field}:{name}".encode()) % ANALYSIS_VECTOR_DIM] += count
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
 def _generate_shopping_suggestions(
     analysis: dict, gaps: list[str], occasion_focus: str = None
 ) -> list[dict]:
     """Use Gemini to generate contextual shopping recommendations."""
+    cache_key = (_wardrobe_fingerprint(analysis, gaps, occasion_focus),)
+    cached = _suggestion_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Suggestions are driven by the gaps, so only analyses with the same gaps count as near-duplicates
+    scope = (occasion_focus, tuple(sorted(gaps)))
+    analysis_vec = _analysis_vector(analysis)
+    cached = _similar_suggestion_cache.get(scope, analysis_vec)
+    if cached is not None:
+        _suggestion_cache.set(cache_key, cached)
+        return cached
+
     fashion_context = retrieve_fashion_context(
         f"essential wardrobe items for {occasion_focus or 'versatile'} style",
         top_k=3,
     )
 
-    prompt = f"""You are a personal fashion advisor. Based on the user's current wardrobe analysis and identified gaps, suggest specific items to purchase.
-
-CURRENT WARDROBE ANALYSIS:
-- Total items: {analysis['total_items']}
-- Categories: {json.dumps(analysis['categories'])}
-- Colors: {json.dumps(analysis['colors'])}
-- Seasons: {json.dumps(analysis['seasons'])}
-
-IDENTIFIED GAPS:
-{chr(10).join(f'- {g}' for g in gaps)}
+    prefix = _render_prompt(
+        _PROMPT_PREFIX_SEGMENTS,
+        focus=f"FOCUS: {occasion_focus} wardrobe" if occasion_focus else "",
+        guidance="FASHION GUIDANCE:\n" + "\n".join(fashion_context) if fashion_context else "",
+    )
+    suffix = _render_prompt(
+        _PROMPT_SUFFIX_SEGMENTS,
+        total_items=str(analysis["total_items"]),
+        categories=_dumps_counts(tuple(analysis["categories"].items())),
+        colors=_dumps_counts(tuple(analysis["colors"].items())),
+        seasons=_dumps_counts(tuple(analysis["seasons"].items())),
+        gaps="\n".join(f"- {g}" for g in gaps),
+    )
 
-{'FOCUS: ' + occasion_focus + ' wardrobe' if occasion_focus else ''}
+    try:
+        # Shared prefix first: groundwork only — gemini-2.0-flash has no implicit caching and the prefix
+        # (~400 tokens) is below any caching minimum, so this gives no cache hits today
+        model = genai.GenerativeModel("gemini-2.0-flash")
+        response = model.generate_content(prefix + suffix, stream=True)
+
+        # Parse as soon as the JSON object closes instead of waiting for the rest of the stream
+        result = _first_json_object(chunk.text for chunk in response)
+        if result is None:
+            response.resolve()
+            text = response.text.strip()
+
+            if text.startswith("```"):
+                text = text.split("\n", 1)[1]
+                if text.endswith("```"):
+                    text = text[:-3]
+                text = text.strip()
+
+            result = orjson.loads(text)
+
+        suggestions = result.get("suggestions", [])
+        _suggestion_cache.set(cache_key, suggestions)
+        _similar_suggestion_cache.set(scope, analysis_vec, suggestions)
+        return suggestions
+    except Exception as e:
+        print(f"Gemini shopping suggestion error: {e}")
+        return _fallback_suggestions(gaps)
 
-{'FASHION GUIDANCE:' + chr(10) + chr(10).join(fashion_context) if fashion_context else ''}
 
-Suggest 3-5 specific items to purchase. For each, explain why it would complement the existing wardrobe.
+def _render_prompt(segments: tuple, **slots: str) -> str:
+    """Fill a pre-parsed prompt template's slots."""
+    parts = []
+    for literal, slot in segments:
+        parts.append(literal)
+        if slot is not None:
+            parts.append(slots[slot])
+    return "".join(parts)
 
-Respond in valid JSON format ONLY:
-{{
-  "suggestions": [
-    {{
-      "item": "Item description (e.g., 'Navy wool blazer')",
-      "category": "category name",
-      "reason": "Why this item fills a gap in the wardrobe",
-      "priority": "high/medium/low",
-      "estimated_price_range": "$XX - $XX"
-    }}
-  ]
-}}"""
 
-    try:
-        model = genai.GenerativeModel("gemini-2.0-flash")
-        response = model.generate_content(prompt)
-        text = response.text.strip()
+@lru_cache(maxsize=1024)
+def _dumps_counts(counts: tuple) -> str:
+    """JSON-encode a counter given as a tuple of items; memoized since wardrobes rarely change."""
+    return orjson.dumps(dict(counts), option=orjson.OPT_NON_STR_KEYS).decode()
 
-        if text.startswith("```"):
-            text = text.split("\n", 1)[1]
-            if text.endswith("```"):
-                text = text[:-3]
-            text = text.strip()
 
-        result = json.loads(text)
-        return result.get("suggestions", [])
-    except Exception as e:
-        print(f"Gemini shopping suggestion error: {e}")
-        return _fallback_suggestions(gaps)
+def _first_json_object(text_chunks) -> dict | None:
+    """
+    Scan streamed text for the first balanced top-level JSON object (skipping markdown fences
+    and prose, ignoring braces inside strings) and parse it the moment it closes.
+    Returns None if no complete, valid object is found.
+    """
+    buf = []
+    depth = 0
+    in_string = escaped = False
+    for chunk in text_chunks:
+        for ch in chunk:
+            if depth == 0 and ch != "{":
+                continue
+            buf.append(ch)
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    try:
+                        return orjson.loads("".join(buf))
+                    except orjson.JSONDecodeError:
+                        return None
+    return None
 
 
 def _fallback_suggestions(gaps: list[str]) -> list[dict]:
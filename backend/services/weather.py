@@ -3,14 +3,69 @@ OpenWeatherMap integration for weather-aware outfit recommendations.
 Uses the free tier (60 calls/min, 1M calls/month, no credit card required).
 """
 import os
+import bisect
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from services.response_cache import QueryCache
 
 load_dotenv()
 
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "")
 BASE_URL = "https://api.openweathermap.org/data/2.5/weather"
 
+# Shared keep-alive session so repeated lookups skip the TCP/TLS handshake
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+# OpenWeather refreshes current conditions roughly every 10 minutes
+WEATHER_CACHE_TTL_SECONDS = 600
+_weather_cache = QueryCache(ttl=WEATHER_CACHE_TTL_SECONDS, max_entries=1024)
+
+# Expired results are kept a while longer with their ETag / Last-Modified for conditional revalidation
+WEATHER_REVALIDATE_TTL_SECONDS = 3600
+_validator_cache = QueryCache(ttl=WEATHER_REVALIDATE_TTL_SECONDS, max_entries=1024)
+
+# Temperature bands (°F, lower bound inclusive) and their style hints, coldest first
+_TEMP_THRESHOLDS = (40, 55, 70, 85)
+_TEMP_HINTS = (
+    (
+        "Cold weather — heavy coat, scarf, and warm layers recommended",
+        "Wool, fleece, or down jackets ideal",
+    ),
+    (
+        "Chilly — wear a warm jacket or coat",
+        "Consider sweaters or hoodies for warmth",
+    ),
+    (
+        "Mild/cool — consider a light jacket or cardigan",
+        "Layering is ideal for this temperature",
+    ),
+    (
+        "Warm weather — light layers, t-shirts, and casual wear",
+        "No heavy jacket needed",
+    ),
+    (
+        "Very hot — wear lightweight, breathable fabrics like linen or cotton",
+        "Opt for light colors to reflect heat",
+        "Shorts, tank tops, or summer dresses recommended",
+    ),
+)
+
+# Precipitation conditions (OpenWeather "main" field) and their style hints
+_WET_CONDITIONS = frozenset({"Rain", "Drizzle", "Thunderstorm"})
+_RAIN_HINTS = (
+    "Rainy — waterproof jacket or umbrella recommended",
+    "Avoid suede or delicate fabrics",
+    "Waterproof boots or shoes advisable",
+)
+_SNOW_HINTS = (
+    "Snowy — insulated, waterproof boots and heavy coat essential",
+    "Layered warm clothing recommended",
+)
+_PRECIP_HINTS = {condition: _RAIN_HINTS for condition in _WET_CONDITIONS}
+_PRECIP_HINTS["Snow"] = _SNOW_HINTS
+
 
 def get_weather(city: str) -> dict | None:
     """
@@ -20,12 +75,33 @@ def get_weather(city: str) -> dict | None:
     if not OPENWEATHER_API_KEY:
         return None
 
+    cache_key = (city.strip().lower(),)
+    cached = _weather_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    headers = {}
+    validators = _validator_cache.get(cache_key)
+    if validators is not None:
+        etag, last_modified, _ = validators
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
     try:
-        response = requests.get(BASE_URL, params={
+        response = _session.get(BASE_URL, params={
             "q": city,
             "appid": OPENWEATHER_API_KEY,
             "units": "imperial",  # Fahrenheit
-        }, timeout=5)
+        }, headers=headers, timeout=5)
+
+        # Unchanged since the last fetch: reuse the previous result without a body
+        if response.status_code == 304 and validators is not None:
+            weather = validators[2]
+            _weather_cache.set(cache_key, weather)
+            _validator_cache.set(cache_key, validators)
+            return weather
 
         if response.status_code != 200:
             print(f"Weather API error: {response.status_code} - {response.text}")
@@ -40,7 +116,7 @@ def get_weather(city: str) -> dict | None:
         main_weather = data["weather"][0]["main"]
         wind_speed = data.get("wind", {}).get("speed", 0)
 
-        return {
+        weather = {
             "city": data["name"],
             "temperature_f": round(temp_f),
             "feels_like_f": round(feels_like_f),
@@ -50,6 +126,11 @@ def get_weather(city: str) -> dict | None:
             "wind_speed": round(wind_speed, 1),
             "style_hints": _get_style_hints(temp_f, main_weather, wind_speed),
         }
+        _weather_cache.set(cache_key, weather)
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if etag or last_modified:
+            _validator_cache.set(cache_key, (etag, last_modified, weather))
+        return weather
     except Exception as e:
         print(f"Weather API exception: {e}")
         return None
@@ -59,34 +140,11 @@ def _get_style_hints(temp_f: float, main_weather: str, wind_speed: float) -> lis
     """
     Convert weather conditions into actionable style hints.
     """
-    hints = []
-
     # Temperature-based hints
-    if temp_f >= 85:
-        hints.append("Very hot — wear lightweight, breathable fabrics like linen or cotton")
-        hints.append("Opt for light colors to reflect heat")
-        hints.append("Shorts, tank tops, or summer dresses recommended")
-    elif temp_f >= 70:
-        hints.append("Warm weather — light layers, t-shirts, and casual wear")
-        hints.append("No heavy jacket needed")
-    elif temp_f >= 55:
-        hints.append("Mild/cool — consider a light jacket or cardigan")
-        hints.append("Layering is ideal for this temperature")
-    elif temp_f >= 40:
-        hints.append("Chilly — wear a warm jacket or coat")
-        hints.append("Consider sweaters or hoodies for warmth")
-    else:
-        hints.append("Cold weather — heavy coat, scarf, and warm layers recommended")
-        hints.append("Wool, fleece, or down jackets ideal")
+    hints = list(_TEMP_HINTS[bisect.bisect_right(_TEMP_THRESHOLDS, temp_f)])
 
     # Precipitation hints
-    if main_weather in ("Rain", "Drizzle", "Thunderstorm"):
-        hints.append("Rainy — waterproof jacket or umbrella recommended")
-        hints.append("Avoid suede or delicate fabrics")
-        hints.append("Waterproof boots or shoes advisable")
-    elif main_weather == "Snow":
-        hints.append("Snowy — insulated, waterproof boots and heavy coat essential")
-        hints.append("Layered warm clothing recommended")
+    hints.extend(_PRECIP_HINTS.get(main_weather, ()))
 
     # Wind hints
     if wind_speed > 15: